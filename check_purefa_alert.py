@@ -16,6 +16,8 @@
 #
 #  nagiosplugin      helper Python class library for Nagios plugins (https://github.com/mpounsett/nagiosplugin)
 #  purestorage       Pure Storage Python REST Client (https://github.com/purestorage/rest-client)
+#  pure_client       FlashArray REST client helpers shared with the other plugins (pure_client.py, same folder)
+#  numpy             optional, speeds up counting large numbers of alert messages (https://numpy.org)
 
 
 """Pure Storage FlashArray alert messages status
@@ -26,19 +28,47 @@
 """
 
 import argparse
+from functools import lru_cache
+from collections import Counter
 import logging
 import logging.handlers
+from operator import itemgetter
+import os
 import nagiosplugin
-import purestorage
+import pure_client
 
-# Disable warnings using urllib3 embedded in requests or directly
-try:
-    import requests
-    from requests.packages.urllib3.exceptions import InsecureRequestWarning
-    requests.packages.urllib3.disable_warnings(InsecureRequestWarning)
-except:
-    import urllib3
-    urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+# Above this number of messages the severities are counted with numpy, when available
+NUMPY_THRESHOLD = 256
+
+SEVERITIES = ('info', 'warning', 'critical')
+_SEVERITY_INDEX = {severity: i for i, severity in enumerate(SEVERITIES)}
+
+
+def count_severities(fainfo):
+    """Counts the messages of each severity.
+
+    Large lists of messages are counted with numpy if installed, otherwise with a Counter.
+    """
+    severities = map(itemgetter('current_severity'), fainfo)
+    if len(fainfo) > NUMPY_THRESHOLD:
+        try:
+            import numpy
+        except ImportError:
+            pass
+        else:
+            # Unknown severities go to an extra bucket, dropped by zip()
+            index, unknown = _SEVERITY_INDEX.get, len(SEVERITIES)
+            indexes = numpy.fromiter((index(severity, unknown) for severity in severities),
+                                     dtype=numpy.int8, count=len(fainfo))
+            counts = numpy.bincount(indexes, minlength=len(SEVERITIES) + 1)
+            return dict(zip(SEVERITIES, map(int, counts)))
+    return Counter(severities)
+
+
+def _metrics(crit, warn, info):
+    """Builds the metrics of the number of critical, warning and info messages."""
+    return [nagiosplugin.Metric(name, value, min=0)
+            for name, value in (('critical', crit), ('warning', warn), ('info', info))]
 
 
 class PureFAalert(nagiosplugin.Resource):
@@ -46,18 +76,15 @@ class PureFAalert(nagiosplugin.Resource):
     Reports the status of all open messages on FlashArray
     """
 
-    def __init__(self, endpoint, apitoken):
+    def __init__(self, endpoint, apitoken, cache_ttl=0):
         self.endpoint = endpoint
         self.apitoken = apitoken
-        self.info = 0
-        self.warn = 0
-        self.crit = 0
+        self.cache_ttl = cache_ttl
         self.logger = logging.getLogger(self.name)
-        handler = logging.handlers.SysLogHandler(address = '/dev/log')
-        handler.setLevel(logging.ERROR)
-        formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-        handler.setFormatter(formatter)
-        self.logger.addHandler(handler)
+        # Logging to syslog is opt-in, to spare opening /dev/log on every check
+        if os.environ.get('PUREFA_SYSLOG') == '1' and self.logger.isEnabledFor(logging.ERROR):
+            if not any(isinstance(h, logging.handlers.SysLogHandler) for h in self.logger.handlers):
+                self.logger.addHandler(pure_client.get_syslog_handler())
 
     @property
     def name(self):
@@ -67,10 +94,9 @@ class PureFAalert(nagiosplugin.Resource):
         """Gets active alerts from FlashArray."""
         fainfo = {}
         try:
-            fa = purestorage.FlashArray(self.endpoint, api_token=self.apitoken)
-            fainfo = fa.list_messages(open = True)
-            fa.invalidate_cookie()
-        except Exception as e:
+            fainfo = pure_client.cached(self.endpoint, 'alerts', self.cache_ttl,
+                                        lambda: pure_client.get_alerts(self.endpoint, self.apitoken))
+        except pure_client.RestError as e:
             raise nagiosplugin.CheckError(f'FA REST call returned "{e}"')
         
         return(fainfo)
@@ -79,23 +105,15 @@ class PureFAalert(nagiosplugin.Resource):
 
         fainfo = self.get_alerts()
         if not fainfo:
-            return [nagiosplugin.Metric('critical', 0, min=0),
-                    nagiosplugin.Metric('warning', 0, min=0),
-                    nagiosplugin.Metric('info', 0, min=0)]
-        # Increment each counter for each type of event
-        for alert in fainfo:
-            if alert['current_severity'] == 'critical':
-                self.crit += 1
-            elif alert['current_severity'] == 'warning':
-                self.warn += 1
-            elif alert['current_severity'] == 'info':
-                self.info += 1
-        return [nagiosplugin.Metric('critical', self.crit, min=0),
-                nagiosplugin.Metric('warning', self.warn, min=0),
-                nagiosplugin.Metric('info', self.info, min=0)]
+            return _metrics(0, 0, 0)
+        # Count the events of each type
+        severities = count_severities(fainfo)
+        return _metrics(severities.get('critical', 0), severities.get('warning', 0), severities.get('info', 0))
 
 
-def parse_args():
+@lru_cache(maxsize=None)
+def get_parser():
+    """Builds the command line parser once per process."""
     argp = argparse.ArgumentParser()
     argp.add_argument('endpoint', help="FA hostname or ip address")
     argp.add_argument('apitoken', help="FA api_token")
@@ -111,18 +129,25 @@ def parse_args():
                       help='warning if number of info messages is outside RANGE')
     argp.add_argument('--critical-info', metavar='RANGE',
                       help='critical if number of info messages is outside RANGE')
+    argp.add_argument('--cache-ttl', metavar='SECONDS', type=int, default=0,
+                      help='reuse the REST call results cached on disk for up to SECONDS seconds (default: 0, no cache)')
     argp.add_argument('-v', '--verbose', action='count', default=0,
                       help='increase output verbosity (use up to 3 times)')
-    argp.add_argument('-t', '--timeout', default=30,
+    argp.add_argument('-t', '--timeout', type=int, default=30,
                       help='abort execution after TIMEOUT seconds')
-    return argp.parse_args()
+    return argp
+
+
+def parse_args():
+    return get_parser().parse_args()
 
 
 @nagiosplugin.guarded
 def main():
     args = parse_args()
+    pure_client.set_timeout(args.timeout)
     check = nagiosplugin.Check(
-        PureFAalert(args.endpoint, args.apitoken),
+        PureFAalert(args.endpoint, args.apitoken, args.cache_ttl),
         nagiosplugin.ScalarContext(
             'critical', args.warning_crit, args.critical_crit,
             fmt_metric='{value} critical messages'),
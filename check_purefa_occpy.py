@@ -16,6 +16,7 @@
 #
 #  nagiosplugin      helper Python class library for Nagios plugins (https://github.com/mpounsett/nagiosplugin)
 #  purestorage       Pure Storage Python REST Client (https://github.com/purestorage/rest-client)
+#  pure_client       FlashArray REST client helpers shared with the other plugins (pure_client.py, same folder)
 
 """Pure Storage FlashArray occupancy status
 
@@ -31,19 +32,12 @@
 """
 
 import argparse
+from functools import lru_cache
 import logging
 import logging.handlers
+import os
 import nagiosplugin
-import purestorage
-
-# Disable warnings using urllib3 embedded in requests or directly
-try:
-    import requests
-    from requests.packages.urllib3.exceptions import InsecureRequestWarning
-    requests.packages.urllib3.disable_warnings(InsecureRequestWarning)
-except:
-    import urllib3
-    urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+import pure_client
 
 
 class PureFAoccpy(nagiosplugin.Resource):
@@ -53,17 +47,17 @@ class PureFAoccpy(nagiosplugin.Resource):
 
     """
 
-    def __init__(self, endpoint, apitoken, volname, percentage):
+    def __init__(self, endpoint, apitoken, volname, percentage, cache_ttl=0):
         self.endpoint = endpoint
         self.apitoken = apitoken
         self.volname = volname
         self.percentage = percentage
+        self.cache_ttl = cache_ttl
         self.logger = logging.getLogger(self.name)
-        handler = logging.handlers.SysLogHandler(address = '/dev/log')
-        handler.setLevel(logging.ERROR)
-        formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-        handler.setFormatter(formatter)
-        self.logger.addHandler(handler)
+        # Logging to syslog is opt-in, to spare opening /dev/log on every check
+        if os.environ.get('PUREFA_SYSLOG') == '1' and self.logger.isEnabledFor(logging.ERROR):
+            if not any(isinstance(h, logging.handlers.SysLogHandler) for h in self.logger.handlers):
+                self.logger.addHandler(pure_client.get_syslog_handler())
 
     @property
     def name(self):
@@ -77,13 +71,13 @@ class PureFAoccpy(nagiosplugin.Resource):
         """Gets performance counters from flasharray."""
         fainfo = {}
         try:
-            fa = purestorage.FlashArray(self.endpoint, api_token=self.apitoken)
             if (self.volname is None):
-                fainfo = fa.get(space=True)[0]
+                fainfo = pure_client.cached(self.endpoint, 'space', self.cache_ttl,
+                                            lambda: pure_client.get_space(self.endpoint, self.apitoken))
             else:
-                fainfo = fa.get_volume(self.volname, space=True)
-            fa.invalidate_cookie()
-        except Exception as e:
+                fainfo = pure_client.cached(self.endpoint, 'vol_' + self.volname, self.cache_ttl,
+                                            lambda: pure_client.get_volume_space(self.endpoint, self.apitoken, self.volname))
+        except pure_client.RestError as e:
             raise nagiosplugin.CheckError(f'FA REST call returned "{e}"')
         return(fainfo)
 
@@ -93,10 +87,14 @@ class PureFAoccpy(nagiosplugin.Resource):
         if not fainfo:
             return ''
         if (self.volname is None):
-            occupancy = round(float(fainfo.get('total'))/float(fainfo.get('capacity')), 2) * 100
+            if not fainfo.get('capacity'):
+                raise nagiosplugin.CheckError('FA capacity is zero')
+            occupancy = round(100.0 * fainfo.get('total') / fainfo.get('capacity'), 2)
             metric = nagiosplugin.Metric('FA occupancy', occupancy, '%', min=0, max=100, context='occupancy')
         elif self.percentage:
-            occupancy = round(float(fainfo.get('total'))/float(fainfo.get('size')), 2) * 100
+            if not fainfo.get('size'):
+                raise nagiosplugin.CheckError(f'{self.volname} size is zero')
+            occupancy = round(100.0 * fainfo.get('total') / fainfo.get('size'), 2)
             metric = nagiosplugin.Metric(self.volname + ' occupancy', occupancy, '%', min=0, max=100, context='occupancy')
         else:
             occupancy = int(fainfo.get('volumes'))
@@ -104,7 +102,9 @@ class PureFAoccpy(nagiosplugin.Resource):
         return metric
 
 
-def parse_args():
+@lru_cache(maxsize=None)
+def get_parser():
+    """Builds the command line parser once per process."""
     argp = argparse.ArgumentParser()
     argp.add_argument('endpoint', help="FA hostname or ip address")
     argp.add_argument('apitoken', help="FA api_token")
@@ -116,17 +116,24 @@ def parse_args():
                       help='return critical if occupancy is outside RANGE. Value has to be expressed in percentage for the FA, while in bytes for the single volume')
     argp.add_argument('-p', '--percentage', action='store_true',
                       help='Set this flag if you want to use percentages instead of bytes for volume space usage. This flag does nothing when checking the whole array')
+    argp.add_argument('--cache-ttl', metavar='SECONDS', type=int, default=0,
+                      help='reuse the REST call results cached on disk for up to SECONDS seconds (default: 0, no cache)')
     argp.add_argument('-v', '--verbose', action='count', default=0,
                       help='increase output verbosity (use up to 3 times)')
-    argp.add_argument('-t', '--timeout', default=30,
+    argp.add_argument('-t', '--timeout', type=int, default=30,
                       help='abort execution after TIMEOUT seconds')
-    return argp.parse_args()
+    return argp
+
+
+def parse_args():
+    return get_parser().parse_args()
 
 
 @nagiosplugin.guarded
 def main():
     args = parse_args()
-    check = nagiosplugin.Check( PureFAoccpy(args.endpoint, args.apitoken, args.vol, args.percentage) )
+    pure_client.set_timeout(args.timeout)
+    check = nagiosplugin.Check( PureFAoccpy(args.endpoint, args.apitoken, args.vol, args.percentage, args.cache_ttl) )
     check.add(nagiosplugin.ScalarContext('occupancy', args.warning, args.critical))
     check.main(args.verbose, args.timeout)
 
@@ -0,0 +1,248 @@
+#!/usr/bin/env python
+# Copyright (c) 2018, 2019, 2020 Pure Storage, Inc.
+#
+# * Overview
+#
+# Helper module shared by the Nagios/Icinga plugins that monitor Pure Storage FlashArrays.
+# The Pure Storage Python REST Client is used to query the FlashArray alert messages and occupancy indicators.
+#
+# * Installation
+#
+# The module must be copied to the same folder as the check_purefa_alert.py and check_purefa_occpy.py plugins,
+# for example the /usr/lib/nagios/plugins folder.
+#
+# * Dependencies
+#
+#  purestorage       Pure Storage Python REST Client (https://github.com/purestorage/rest-client)
+#  orjson            optional, faster parsing of the REST responses (https://github.com/ijl/orjson)
+
+"""Pure Storage FlashArray REST client helpers
+
+   Keeps a single pooled REST session per FlashArray for the whole plugin process and
+   retrieves the open alert messages and the space indicators used by the alert and
+   occupancy plugins, with a single REST query per check.
+"""
+
+import atexit
+import json
+import logging
+import logging.handlers
+import sys
+import time
+import types
+from functools import wraps
+from urllib.parse import quote
+import nagiosplugin
+
+# On-disk cache of the REST call results, by endpoint and query type
+CACHE_FILE = '/var/tmp/purefa_{endpoint}_{qtype}.json'
+
+# Fields of the REST responses actually read by the plugins. The responses are trimmed to them
+# after the download, which saves no bytes on the wire but keeps the cached results small
+MESSAGE_FIELDS = ('current_severity',)
+SPACE_FIELDS = ('total', 'capacity')
+VOLUME_SPACE_FIELDS = ('total', 'size', 'volumes')
+
+# Connect timeout of the REST calls, in seconds
+CONNECT_TIMEOUT = 3
+
+# Retries of the REST calls failing to connect, and first backoff delay in seconds
+RETRIES = 2
+RETRY_BACKOFF = 0.25
+
+# Timeout of the logout REST call issued at exit, in seconds
+LOGOUT_TIMEOUT = 2
+
+# Keep-alive HTTP session shared by all the REST calls issued by the plugin
+_session = None
+
+# (connect, read) timeouts and retries of the REST calls, see set_timeout() and _logout()
+_timeout = None
+_retries = RETRIES
+
+# Exceptions of the REST calls raised as RestError, completed by _lazy_init(): malformed
+# or unexpected responses, REST client and requests errors
+_client_errors = (ValueError, LookupError)
+
+# Syslog handler shared by all the plugin loggers
+_syslog = None
+
+# FlashArray REST sessions, by (endpoint, apitoken)
+_flasharrays = {}
+
+
+class RestError(Exception):
+    """Raised when a FlashArray REST call fails."""
+
+
+def set_timeout(seconds):
+    """Sets the overall timeout of each REST call, split into connect and read timeouts."""
+    global _timeout
+    _timeout = (CONNECT_TIMEOUT, max(seconds - 2, CONNECT_TIMEOUT))
+
+
+def get_syslog_handler():
+    """Gets the syslog handler, opening /dev/log only once per process."""
+    global _syslog
+    if _syslog is None:
+        _syslog = logging.handlers.SysLogHandler(address = '/dev/log')
+        _syslog.setLevel(logging.ERROR)
+        _syslog.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
+    return _syslog
+
+
+def _logout(fa):
+    """Invalidates the REST session cookie at exit.
+
+    This runs after the check result is printed and outside of the plugin timeout,
+    so the logout gets a short timeout and no retries not to delay the exit.
+    """
+    global _timeout, _retries
+    _timeout, _retries = (LOGOUT_TIMEOUT, LOGOUT_TIMEOUT), 0
+    try:
+        fa.invalidate_cookie()
+    except Exception:
+        pass
+
+
+def _lazy_init():
+    """Imports and sets up the REST client on first use.
+
+    The REST client and requests are only loaded when a REST call is actually needed,
+    which keeps the plugin startup short when the results come from the cache.
+    """
+    global _session, _client_errors
+    if _session is not None:
+        return
+    import purestorage
+    import requests
+    from requests.adapters import HTTPAdapter
+
+    # Disable warnings using urllib3 embedded in requests or directly
+    try:
+        from requests.packages.urllib3.exceptions import InsecureRequestWarning
+        requests.packages.urllib3.disable_warnings(InsecureRequestWarning)
+    except:
+        import urllib3
+        urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+
+    # Parse the REST responses with orjson when available, raising the decode errors
+    # as the JSONDecodeError Response.json() expects
+    try:
+        import orjson
+    except ImportError:
+        pass
+    else:
+        # requests.compat.JSONDecodeError only exists since requests 2.27
+        decode_error = getattr(requests.compat, 'JSONDecodeError', json.JSONDecodeError)
+
+        def loads(text, **kwargs):
+            try:
+                return orjson.loads(text)
+            except orjson.JSONDecodeError as e:
+                raise decode_error(e.msg, e.doc, e.pos) from e
+        requests.models.complexjson = types.SimpleNamespace(loads=loads, dumps=requests.models.complexjson.dumps)
+
+    _session = requests.Session()
+    _session.mount('https://', HTTPAdapter(pool_connections=1, pool_maxsize=4))
+    _client_errors += (purestorage.PureError, requests.exceptions.RequestException)
+
+    # The REST client calls requests.request() for each call, opening a new connection
+    # every time. Route its calls through the pooled session instead
+    sys.modules[purestorage.FlashArray.__module__].requests = types.SimpleNamespace(
+        request=_request, exceptions=requests.exceptions)
+
+
+def _request(method, url, **kwargs):
+    """Issues an HTTP request of the REST client on the pooled session.
+
+    Connection errors and connect timeouts are retried with an exponential backoff. TLS errors
+    are not transient and read timeouts would not leave time for another attempt, so they are
+    not retried. Transport errors are raised as RestError, so that the REST client lets them
+    through: on Python 3 it fails to wrap them, reading their missing 'message' attribute.
+    """
+    import requests
+    kwargs.setdefault('timeout', _timeout)
+    for attempt in range(_retries + 1):
+        try:
+            return _session.request(method, url, **kwargs)
+        except requests.exceptions.SSLError as e:
+            raise RestError(e) from e
+        except requests.exceptions.ConnectionError as e:
+            # Also covers the connect timeouts
+            if attempt == _retries:
+                raise RestError(e) from e
+            time.sleep(RETRY_BACKOFF * 2 ** attempt)
+        except requests.exceptions.RequestException as e:
+            raise RestError(e) from e
+
+
+def _rest_call(func):
+    """Raises the REST call errors of func, such as authentication failures, as RestError."""
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        try:
+            return func(*args, **kwargs)
+        except _client_errors as e:
+            raise RestError(e) from e
+    return wrapper
+
+
+def get_flasharray(endpoint, apitoken):
+    """Gets the REST session to the FlashArray, logging in only once."""
+    key = (endpoint, apitoken)
+    if key not in _flasharrays:
+        _lazy_init()
+        import purestorage
+        fa = purestorage.FlashArray(endpoint, api_token=apitoken)
+        atexit.register(_logout, fa)
+        _flasharrays[key] = fa
+    return _flasharrays[key]
+
+
+def select(item, fields):
+    """Keeps only the given fields of a REST response item, to shrink the cached results."""
+    return {field: item.get(field) for field in fields}
+
+
+@_rest_call
+def get_alerts(endpoint, apitoken):
+    """Gets the open alert messages from the FlashArray."""
+    fa = get_flasharray(endpoint, apitoken)
+    return [select(message, MESSAGE_FIELDS) for message in fa.list_messages(open=True)]
+
+
+@_rest_call
+def get_space(endpoint, apitoken):
+    """Gets the array space indicators from the FlashArray."""
+    fa = get_flasharray(endpoint, apitoken)
+    return select(fa.get(space=True)[0], SPACE_FIELDS)
+
+
+@_rest_call
+def get_volume_space(endpoint, apitoken, volname):
+    """Gets the space indicators of a single volume from the FlashArray."""
+    fa = get_flasharray(endpoint, apitoken)
+    return select(fa.get_volume(volname, space=True), VOLUME_SPACE_FIELDS)
+
+
+def cached(endpoint, qtype, ttl, fetch):
+    """Gets the REST call results from the on-disk cache if not older than ttl seconds.
+
+    Otherwise calls fetch() and stores its results in the cache. A ttl of 0 disables the cache.
+    """
+    if not ttl:
+        return fetch()
+    # Volume names may hold '/' (volume groups) or '::' (pods): keep them out of the path
+    path = CACHE_FILE.format(endpoint=quote(endpoint, safe=''), qtype=quote(qtype, safe=''))
+    # The cookie is only committed after a fetch, to spare a rewrite and fsync on cache hits
+    cookie = nagiosplugin.Cookie(path).open()
+    try:
+        if time.time() - cookie.get('ts', 0) < ttl:
+            return cookie['data']
+        cookie['data'] = fetch()
+        cookie['ts'] = time.time()
+        cookie.commit()
+        return cookie['data']
+    finally:
+        cookie.close()